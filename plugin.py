@@ -10,15 +10,33 @@ JM 本子下载插件
 作者：yumemi1
 项目：https://github.com/yumemi1/jm_plugin
 """
+
 import asyncio
+import functools
+import io
 import os
 import re
 import json
-from typing import List, Tuple, Type, Optional
+import pickle
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, fields
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Tuple, Type, Optional, Union
 from pathlib import Path
 
-import aiohttp
-from PIL import Image
+# jmcomic / Pillow / img2pdf / aiohttp / aiofiles 均在首次使用时才导入，
+# 未调用 /jm 时不会拖慢宿主启动，也不占用额外内存
+if TYPE_CHECKING:
+    import aiohttp
+    from PIL import Image
+
+try:
+    import orjson  # 可选：更快的 JSON 编解码，未安装时使用标准库 json
+except ImportError:
+    orjson = None
 
 from src.plugin_system import (
     BasePlugin,
@@ -27,6 +45,13 @@ from src.plugin_system import (
     ComponentInfo,
     ConfigField,
 )
+
+try:
+    # 事件处理器接口只在较新的宿主中提供；旧版宿主上仅不注册会话关闭处理器，/jm 照常可用
+    from src.plugin_system import BaseEventHandler, EventType
+except ImportError:
+    BaseEventHandler = None
+    EventType = None
 from src.config.config import global_config
 
 
@@ -35,6 +60,9 @@ from src.config.config import global_config
 # 工具函数
 # =============================================================================
 
+_ILLEGAL_FILENAME_CHARS = re.compile(r'[\\/:*?"<>|\r\n]+')
+
+
 def sanitize_filename(name: str) -> str:
     """将文件名中的非法字符替换为下划线。
 
@@ -46,49 +74,506 @@ def sanitize_filename(name: str) -> str:
     Returns:
         处理后的安全文件名
     """
-    return re.sub(r'[\\/:*?"<>|\r\n]+', '_', name).strip()
+    return _ILLEGAL_FILENAME_CHARS.sub('_', name).strip()
+
+
+# 持有后台任务的强引用，防止任务在完成前被垃圾回收
+_BACKGROUND_TASKS: set = set()
+
+
+def _spawn_background(coro) -> asyncio.Task:
+    """以后台任务方式运行协程，调用方无需等待其完成。"""
+    task = asyncio.create_task(coro)
+    _BACKGROUND_TASKS.add(task)
+    task.add_done_callback(_BACKGROUND_TASKS.discard)
+    return task
+
+
+async def _remove_quietly(path: str) -> None:
+    """异步删除文件，忽略文件不存在等错误。"""
+    import aiofiles.os
+
+    try:
+        await aiofiles.os.remove(path)
+    except OSError:
+        pass
+
+
+_IMAGE_EXTENSIONS = {"jpg", "jpeg", "png", "webp"}
+
+_DIGITS_PATTERN = re.compile(r"(\d+)")
+
+
+def _natural_sort_key(path: str) -> Tuple:
+    """自然排序键：路径中的数字按数值比较，如 2.jpg 排在 10.jpg 之前。
+
+    re.split 带捕获组时结果总是“文本、数字、文本……”交替，
+    因此不同路径的键在同一位置上类型一致，可以直接比较。
+    """
+    parts = _DIGITS_PATTERN.split(path)
+    return tuple(int(part) if i % 2 else part for i, part in enumerate(parts))
+
+
+def _collect_images(root: str) -> List[str]:
+    """递归收集目录下的全部图片文件路径。
+
+    使用 os.scandir 单次遍历目录树，按扩展名集合匹配，
+    避免对每种扩展名各做一次 rglob。
+
+    Args:
+        root: 起始目录
+
+    Returns:
+        按自然顺序排序的图片路径列表（str）
+    """
+    images: List[str] = []
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.name.rpartition(".")[2].lower() in _IMAGE_EXTENSIONS and entry.is_file():
+                        images.append(entry.path)
+        except OSError:
+            continue
+    # key 对每个元素只计算一次，相当于一次装饰-排序-去装饰
+    images.sort(key=_natural_sort_key)
+    return images
+
+
+
+def _to_rgb(im: "Image.Image") -> "Image.Image":
+    """转换为 RGB 模式；带透明通道的图片先合成到白色背景上。
+
+    直接 convert("RGB") 会丢弃 alpha，透明区域通常变成黑色。
+    合成使用 Pillow 的 C 实现（paste + mask），不在 Python 层逐像素处理。
+    """
+    from PIL import Image
+
+    if im.mode in ("RGBA", "LA", "PA") or (im.mode == "P" and "transparency" in im.info):
+        rgba = im.convert("RGBA")
+        try:
+            background = Image.new("RGB", rgba.size, (255, 255, 255))
+            background.paste(rgba, mask=rgba.getchannel("A"))
+            return background
+        finally:
+            rgba.close()
+    return im.convert("RGB")
+
+
+def _page_source(
+    img_path: str,
+    max_dim: int = 0,
+    jpeg_quality: int = 75,
+    force_transcode: bool = False,
+) -> Union[str, bytes]:
+    """准备单个 PDF 页面的数据，供 img2pdf 嵌入。
+
+    JPEG 且无需缩放时直接返回原路径（无损嵌入，不解码）；否则解码为 RGB（透明区域铺白）、
+    按 max_dim 等比缩小后重新编码为 JPEG 字节。解码后的像素在返回前即释放，
+    因此同一时刻驻留内存的解码帧数不超过线程数。
+    """
+    from PIL import Image
+
+    with Image.open(img_path) as im:
+        needs_resize = max_dim > 0 and max(im.size) > max_dim
+        if not force_transcode and im.format == "JPEG" and not needs_resize:
+            return img_path
+        if needs_resize and im.format == "JPEG":
+            # 解码前缩放：thumbnail 会先调用 draft，让 JPEG 解码器直接按 1/2、1/4…
+            # 的比例在 DCT 域解码，再做 LANCZOS 重采样，省去大部分解码与重采样开销
+            im.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        img = _to_rgb(im)
+
+    try:
+        if max_dim > 0 and max(img.size) > max_dim:
+            img.thumbnail((max_dim, max_dim), Image.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=jpeg_quality, optimize=True)
+        return buffer.getvalue()
+    finally:
+        img.close()
+
+
+class PdfLimitError(ValueError):
+    """图片页数或总大小超出配置上限，消息文本可直接展示给用户。"""
+
+
+def check_pdf_limits(image_paths: List[str], max_pages: int = 0, max_total_bytes: int = 0) -> None:
+    """在合成 PDF 之前检查页数与图片文件总字节数。
+
+    Args:
+        image_paths: 图片文件路径列表
+        max_pages: 最大页数，0 表示不限制
+        max_total_bytes: 图片文件总字节数上限，0 表示不限制
+
+    Raises:
+        PdfLimitError: 当超出页数/大小限制时
+    """
+    # 先检查页数，超限时无需逐个 stat 图片
+    check_limit_totals(len(image_paths), 0, max_pages)
+    if max_total_bytes > 0:
+        total_bytes = sum(os.stat(p).st_size for p in image_paths)
+        check_limit_totals(len(image_paths), total_bytes, max_pages, max_total_bytes)
 
 
+def check_limit_totals(pages: int, total_bytes: int, max_pages: int = 0, max_total_bytes: int = 0) -> None:
+    """按已知的页数与图片总字节数检查限制（如命中缓存时），0 表示不限制。
 
-def images_to_pdf_sync(image_paths: List[Path], output_pdf_path: str) -> str:
+    Raises:
+        PdfLimitError: 当超出页数/大小限制时
+    """
+    if max_pages > 0 and pages > max_pages:
+        raise PdfLimitError(f"页数超过 {max_pages}，不生成 PDF")
+    if max_total_bytes > 0 and total_bytes > max_total_bytes:
+        raise PdfLimitError(
+            f"图片总大小 {total_bytes / 1024 / 1024:.1f} MB 超过 "
+            f"{max_total_bytes / 1024 / 1024:.1f} MB，不生成 PDF"
+        )
+
+
+def write_pdf_sync(pages: List[Union[str, bytes]], output_pdf_path: str) -> str:
+    """用 img2pdf 将已准备好的页面按顺序写入 PDF，自动创建输出目录。
+
+    Args:
+        pages: _page_source 的结果列表（JPEG 路径或 JPEG 字节）
+        output_pdf_path: 输出 PDF 文件路径
+
+    Returns:
+        生成的 PDF 文件路径
+    """
+    import img2pdf
+
+    os.makedirs(os.path.dirname(output_pdf_path), exist_ok=True)
+    with open(output_pdf_path, "wb") as pdf_file:
+        img2pdf.convert(pages, outputstream=pdf_file)
+    return output_pdf_path
+
+
+
+# =============================================================================
+# 专用线程池
+# =============================================================================
+
+# jmcomic 下载与 PDF 合成各用独立线程池，避免与默认执行器及彼此争抢线程；
+# PDF 线程池是页面解码/编码唯一的并发来源，pdf_workers 即同时处理的页面数上限
+_JMCOMIC_POOL: Optional[ThreadPoolExecutor] = None
+_PIL_POOL: Optional[ThreadPoolExecutor] = None
+_PIL_WORKERS = 1
+# 可选的 PDF 合成进程池，完全绕开宿主进程的 GIL；不可用时自动回退到线程池
+_PDF_PROCESS_POOL: Optional[ProcessPoolExecutor] = None
+_PDF_PROCESS_WORKERS = 0
+_PDF_PROCESS_POOL_FAILED = False
+
+
+def _process_pool_context():
+    """进程池使用的多进程上下文。
+
+    宿主进程中已运行事件循环、aiohttp 与多个线程池，fork 出的子进程可能继承
+    被其他线程持有的锁而死锁（Python 3.12 起对此给出 DeprecationWarning）。
+    forkserver 从单线程的服务进程派生工作进程，不支持时（Windows）使用 spawn。
+    两者都会在工作进程中以 __mp_main__ 导入宿主入口脚本（要求入口遵循
+    if __name__ == "__main__" 约定），并按模块名导入插件；
+    导入失败时进程池损坏并回退到线程池。
+    """
+    import multiprocessing
+
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def _pil_capacity() -> int:
+    """当前页面执行器可同时处理的任务数：启用进程池时为进程数，否则为线程数。"""
+    if _PDF_PROCESS_POOL is not None:
+        return _PDF_PROCESS_WORKERS
+    return _PIL_WORKERS
+
+
+def init_executors(
+    jm_download_workers: int = 4,
+    pdf_workers: int = 0,
+    pdf_process_workers: int = 0,
+) -> None:
+    """创建专用线程池（及可选的进程池），仅首次调用生效。
+
+    Args:
+        jm_download_workers: jmcomic 下载线程池大小
+        pdf_workers: PDF 页面处理线程池大小，0 表示使用 CPU 核心数
+        pdf_process_workers: PDF 页面处理进程池大小，0 表示不使用进程池
+    """
+    global _JMCOMIC_POOL, _PIL_POOL, _PIL_WORKERS, _PDF_PROCESS_POOL, _PDF_PROCESS_WORKERS
+    if _JMCOMIC_POOL is None:
+        _JMCOMIC_POOL = ThreadPoolExecutor(
+            max_workers=max(1, jm_download_workers),
+            thread_name_prefix="jm_download",
+        )
+    if _PIL_POOL is None:
+        _PIL_WORKERS = pdf_workers if pdf_workers > 0 else (os.cpu_count() or 1)
+        _PIL_POOL = ThreadPoolExecutor(
+            max_workers=_PIL_WORKERS,
+            thread_name_prefix="jm_pdf",
+        )
+    if _PDF_PROCESS_POOL is None and pdf_process_workers > 0 and not _PDF_PROCESS_POOL_FAILED:
+        _PDF_PROCESS_WORKERS = pdf_process_workers
+        _PDF_PROCESS_POOL = ProcessPoolExecutor(
+            max_workers=pdf_process_workers,
+            mp_context=_process_pool_context(),
+        )
+
+
+async def run_in_jmcomic_pool(func, *args, **kwargs):
+    """在 jmcomic 专用线程池中执行阻塞函数。"""
+    init_executors()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_JMCOMIC_POOL, functools.partial(func, *args, **kwargs))
+
+
+def _disable_process_pool(pool: ProcessPoolExecutor) -> None:
+    """永久停用进程池并回退到线程池。
+
+    关闭时不取消其他命令已提交的任务，它们照常完成。
+    """
+    global _PDF_PROCESS_POOL, _PDF_PROCESS_POOL_FAILED
+    _PDF_PROCESS_POOL_FAILED = True
+    if _PDF_PROCESS_POOL is pool:
+        _PDF_PROCESS_POOL = None
+        pool.shutdown(wait=False)
+
+
+def _submit_pil_job(job: Callable[[], Any]) -> Tuple[Any, Optional[ProcessPoolExecutor]]:
+    """同步提交页面任务，启用进程池时优先提交到子进程。
+
+    提交前先确认任务可以序列化：插件模块无法按名称导入时在此失败。
+    序列化或提交失败时永久回退到线程池。可在任意线程中调用。
+
+    Returns:
+        (concurrent.futures.Future, 所用的进程池；提交到线程池时为 None)
+    """
+    pool = _PDF_PROCESS_POOL
+    if pool is not None:
+        try:
+            pickle.dumps(job)
+            return pool.submit(job), pool
+        except (pickle.PicklingError, TypeError, AttributeError, RuntimeError):
+            # RuntimeError 包括进程池已关闭及 BrokenProcessPool
+            _disable_process_pool(pool)
+    return _PIL_POOL.submit(job), None
+
+
+async def run_in_pil_pool(func, *args, **kwargs):
+    """在 PDF 页面处理专用执行器中执行阻塞函数。
+
+    启用进程池时优先在子进程中执行（func 与参数须可 pickle，仅传路径等简单对象），
+    选择规则见 _submit_pil_job；进程池损坏时永久回退到线程池并重新执行。
+    任务自身抛出的异常原样向上传递。
+    """
+    init_executors()
+    job = functools.partial(func, *args, **kwargs)
+
+    future, pool = _submit_pil_job(job)
+    if pool is not None:
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            _disable_process_pool(pool)
+            future = _PIL_POOL.submit(job)
+    return await asyncio.wrap_future(future)
+
+
+async def _prepare_pages(
+    image_paths: List[str],
+    max_dim: int = 0,
+    jpeg_quality: int = 75,
+    prepared: Optional[Dict[str, Union[str, bytes]]] = None,
+    force_transcode: bool = False,
+) -> List[Union[str, bytes]]:
+    """在 PDF 专用执行器中逐页并行执行 _page_source，结果保持输入顺序。
+
+    每次合成同时提交到执行器的页面数不超过当前执行器（进程池或线程池）的并发数，
+    多个用户同时合成时各自的页面交替执行，不会整体排在一个大本子之后。
+    """
+    ready = {} if force_transcode else (prepared or {})
+    limiter = asyncio.Semaphore(_pil_capacity())
+
+    async def one(img_path: str) -> Union[str, bytes]:
+        source = ready.get(os.path.abspath(img_path))
+        if source is not None:
+            return source
+        async with limiter:
+            return await run_in_pil_pool(
+                _page_source, img_path, max_dim, jpeg_quality, force_transcode
+            )
+
+    return list(await asyncio.gather(*(one(p) for p in image_paths)))
+
+
+async def images_to_pdf(
+    image_paths: List[str],
+    output_pdf_path: str,
+    max_dim: int = 0,
+    jpeg_quality: int = 75,
+    max_pages: int = 0,
+    max_total_bytes: int = 0,
+    prepared: Optional[Dict[str, Union[str, bytes]]] = None,
+) -> str:
     """按顺序将图片合并为单个 PDF。
 
-    - 所有图片统一转换为 RGB 模式。
+    - 合成前先检查页数与图片总字节数限制，超出时直接报错；
+      下载期间的预处理（PagePrefetcher）按同样的上限边下载边累计，
+      超限即停止并丢弃已处理的页面，因此超限的本子最多多处理几页。
+    - 使用 img2pdf 组装 PDF：无需缩放的 JPEG 页面直接嵌入原始数据，不做解码与重编码。
+    - 其余页面（PNG/WebP 或超出 max_dim 的 JPEG）转换为 RGB，等比缩小后
+      以 jpeg_quality 质量编码为 JPEG 再嵌入。
+    - 页面处理逐页提交到 PDF 专用执行器并行进行，结果保持输入顺序；
+      每页处理完即释放解码像素，同时驻留的解码帧数不超过线程数。
+      压缩后的页面数据（JPEG 原始字节或重编码结果）会全部保留到 PDF 写入完成，
+      这部分内存随页数线性增长，由 max_pages / max_total_bytes 限制。
+    - prepared 中已有的页面（下载期间由 PagePrefetcher 提前处理）直接使用，不再重复处理。
     - 自动创建输出目录（若不存在）。
 
     Args:
         image_paths: 图片文件路径列表
         output_pdf_path: 输出 PDF 文件路径
+        max_dim: 页面长边像素上限，0 表示不缩放
+        jpeg_quality: 重新编码页面的 JPEG 质量（1-95）
+        max_pages: 最大页数，0 表示不限制
+        max_total_bytes: 图片文件总字节数上限，0 表示不限制
+        prepared: 图片绝对路径到已处理页面数据的映射，可选
 
     Returns:
         生成的 PDF 文件路径
 
     Raises:
         ValueError: 当没有图片提供时
+        PdfLimitError: 当超出页数/大小限制时
     """
     if not image_paths:
         raise ValueError("没有图片可合并")
 
-    images: List[Image.Image] = []
-    # 使用上下文管理器确保文件句柄及时释放
-    for img_path in image_paths:
-        with Image.open(img_path) as im:
-            img = im.convert("RGB") if im.mode != "RGB" else im.copy()
-        images.append(img)
-
-    os.makedirs(os.path.dirname(output_pdf_path), exist_ok=True)
+    init_executors()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(
+        _PIL_POOL, check_pdf_limits, image_paths, max_pages, max_total_bytes
+    )
 
-    first_image = images[0]
-    remaining_images = images[1:]
-    first_image.save(output_pdf_path, save_all=True, append_images=remaining_images)
+    try:
+        pages = await _prepare_pages(image_paths, max_dim, jpeg_quality, prepared)
+        return await loop.run_in_executor(_PIL_POOL, write_pdf_sync, pages, output_pdf_path)
+    except Exception:
+        # 个别 JPEG 无法被 img2pdf 直接嵌入时，全部重新编码后重试
+        pages = await _prepare_pages(image_paths, max_dim, jpeg_quality, force_transcode=True)
+        return await loop.run_in_executor(_PIL_POOL, write_pdf_sync, pages, output_pdf_path)
+
+
+class PagePrefetcher:
+    """下载期间提前处理已落盘的图片，使页面转码与剩余图片的下载重叠进行。
+
+    submit 由 jmcomic 下载线程在每张图片保存后调用，任务与合成时一样经 _submit_pil_job
+    提交（启用进程池时在子进程中转码，不占用机器人进程的 GIL）；
+    collect 在下载结束后等待已开始的任务，返回可直接传给 images_to_pdf 的 prepared。
+    处理失败或尚未开始的页面不放入结果，合成 PDF 时会重新处理并按原有逻辑报错或重试。
+
+    - 同一时刻最多提交执行器并发数（进程数或 pdf_workers）个页面，其余在本地排队，
+      不会占满执行器队列让其他用户的合成排在一个大本子之后。
+    - 累计页数或图片字节数超过上限后立即停止并丢弃已有结果：
+      超限的本子随后会在合成前被拒绝，无需为它转码。
+    """
 
-    for img in images:
+    def __init__(
+        self,
+        max_dim: int = 0,
+        jpeg_quality: int = 75,
+        max_pages: int = 0,
+        max_total_bytes: int = 0,
+    ):
+        self.max_dim = max_dim
+        self.jpeg_quality = jpeg_quality
+        self.max_pages = max_pages
+        self.max_total_bytes = max_total_bytes
+        # submit 与完成回调分别在下载线程和执行器的线程中执行；
+        # 完成回调可能在 _pump 内同步触发，因此使用可重入锁
+        self._lock = threading.RLock()
+        self._futures: Dict[str, Any] = {}
+        self._queue: deque = deque()
+        self._in_flight = 0
+        self._pages = 0
+        self._bytes = 0
+        self._stopped = False
+
+    def submit(self, img_path: str) -> None:
+        if _PIL_POOL is None or img_path.rpartition(".")[2].lower() not in _IMAGE_EXTENSIONS:
+            return
         try:
-            img.close()
-        except Exception:
-            pass
+            size = os.stat(img_path).st_size
+        except OSError:
+            return
+
+        with self._lock:
+            if self._stopped:
+                return
+            self._pages += 1
+            self._bytes += size
+            if (self.max_pages > 0 and self._pages > self.max_pages) or (
+                self.max_total_bytes > 0 and self._bytes > self.max_total_bytes
+            ):
+                self._stop()
+                return
+            self._queue.append(img_path)
+            self._pump()
+
+    def _pump(self) -> None:
+        with self._lock:
+            while self._queue and not self._stopped and self._in_flight < _pil_capacity():
+                img_path = self._queue.popleft()
+                try:
+                    future, pool = _submit_pil_job(functools.partial(
+                        _page_source, img_path, self.max_dim, self.jpeg_quality
+                    ))
+                except Exception:
+                    continue
+                self._in_flight += 1
+                self._futures[os.path.abspath(img_path)] = future
+                future.add_done_callback(functools.partial(self._on_done, pool=pool))
+
+    def _on_done(self, future, pool: Optional[ProcessPoolExecutor] = None) -> None:
+        if (
+            pool is not None
+            and not future.cancelled()
+            and isinstance(future.exception(), BrokenProcessPool)
+        ):
+            _disable_process_pool(pool)
+        with self._lock:
+            self._in_flight -= 1
+            self._pump()
+
+    def _stop(self) -> None:
+        with self._lock:
+            self._stopped = True
+            self._queue.clear()
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+
+    async def collect(self) -> Dict[str, Union[str, bytes]]:
+        with self._lock:
+            # 尚未开始的页面交给 images_to_pdf 处理，不再等待本地队列排空
+            self._queue.clear()
+            futures = dict(self._futures)
+        results = await asyncio.gather(
+            *(asyncio.wrap_future(f) for f in futures.values()),
+            return_exceptions=True,
+        )
+        return {
+            key: result
+            for key, result in zip(futures, results)
+            if not isinstance(result, BaseException)
+        }
 
-    return output_pdf_path
+    def cancel(self) -> None:
+        self._stop()
 
 
 
@@ -96,6 +581,199 @@ def images_to_pdf_sync(image_paths: List[Path], output_pdf_path: str) -> str:
 # Napcat API 交互
 # =============================================================================
 
+# 全局复用的 HTTP 会话，跨多次上传共享连接池与 keep-alive 连接
+_SESSION: Optional["aiohttp.ClientSession"] = None
+_SESSION_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+# auto 模式下按 Napcat 地址记录上次成功的上传方式（"path" / "form"）
+_UPLOAD_MODE_CACHE: Dict[str, str] = {}
+
+
+async def get_session(pool_size: int = 8) -> "aiohttp.ClientSession":
+    """获取全局复用的 aiohttp 会话，首次调用时惰性创建。
+
+    会话绑定创建时的事件循环；若会话已关闭或事件循环已更换，则重新创建，
+    旧会话在替换前关闭，避免泄漏连接器。
+    Napcat 通常只有一个主机，连接池按单主机场景设置。
+
+    Args:
+        pool_size: 每个主机的最大连接数，仅在创建会话时生效
+
+    Returns:
+        可复用的 aiohttp.ClientSession
+    """
+    import aiohttp
+
+    global _SESSION, _SESSION_LOOP
+
+    loop = asyncio.get_running_loop()
+    if _SESSION is None or _SESSION.closed or _SESSION_LOOP is not loop:
+        if _SESSION is not None and not _SESSION.closed:
+            await _close_stale_session(_SESSION, _SESSION_LOOP)
+        connector = aiohttp.TCPConnector(
+            limit=32,
+            limit_per_host=max(1, pool_size),
+            keepalive_timeout=75,
+            ttl_dns_cache=300,
+            # 新版 Python 已修复 SSL 连接泄漏问题，aiohttp 会对该参数给出弃用警告
+            enable_cleanup_closed=getattr(aiohttp.connector, "NEEDS_CLEANUP_CLOSED", True),
+        )
+        _SESSION = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=60),
+            json_serialize=_json_dumps,
+        )
+        _SESSION_LOOP = loop
+    return _SESSION
+
+
+async def _close_stale_session(
+    session: "aiohttp.ClientSession",
+    session_loop: Optional[asyncio.AbstractEventLoop],
+) -> None:
+    """尽力关闭属于其他事件循环的旧会话。
+
+    旧循环仍在其他线程运行时把关闭操作交回该循环执行；
+    否则在当前循环中关闭，旧循环已关闭导致的异常直接忽略。
+    """
+    try:
+        running = asyncio.get_running_loop()
+        if session_loop is not None and session_loop is not running and session_loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), session_loop)
+        else:
+            await session.close()
+    except Exception:
+        pass
+
+
+async def close_session() -> None:
+    """关闭全局 aiohttp 会话（若存在），由插件停止时的事件处理器调用。"""
+    global _SESSION, _SESSION_LOOP
+    session, session_loop = _SESSION, _SESSION_LOOP
+    _SESSION = None
+    _SESSION_LOOP = None
+    if session is not None and not session.closed:
+        await _close_stale_session(session, session_loop)
+
+
+@functools.cache
+def _sized_payload_class() -> type:
+    """返回长度已知的异步迭代负载类（首次调用时才导入 aiohttp 并定义）。
+
+    aiohttp 的 AsyncIterablePayload 默认长度未知，会退化为分块传输；
+    显式给出长度后 multipart 请求即可携带 Content-Length。
+    """
+    import aiohttp
+
+    class _SizedAsyncIterablePayload(aiohttp.AsyncIterablePayload):
+        def __init__(self, value, size: int, *args, **kwargs) -> None:
+            super().__init__(value, *args, **kwargs)
+            self._size = size
+
+    return _SizedAsyncIterablePayload
+
+
+async def _iter_file_chunks(file_obj, chunk_size: int = 64 * 1024):
+    """从 aiofiles 文件对象中按块异步读取内容。"""
+    while True:
+        chunk = await file_obj.read(chunk_size)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _json_dumps(obj: Any) -> str:
+    """序列化 JSON（非 ASCII 字符不转义），安装了 orjson 时优先使用。"""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _json_loads(data: Union[str, bytes]) -> Any:
+    """反序列化 JSON，安装了 orjson 时优先使用。"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _format_response(response_text: str) -> str:
+    """尝试将 Napcat 的 JSON 响应格式化为可读文本。"""
+    try:
+        return _json_dumps(_json_loads(response_text))
+    except Exception:
+        return response_text
+
+
+def _check_napcat_response(status: int, response_text: str) -> Tuple[bool, str]:
+    """判断 Napcat 上传接口是否成功。
+
+    OneBot 11 中动作失败（如 path 模式下远程主机上不存在该文件）时 Napcat 仍返回 HTTP 200，
+    需结合响应体的 status == "ok" / retcode == 0 判断，否则 auto 模式会记住无效的方式。
+
+    Returns:
+        (是否成功, 响应文本或错误信息)
+    """
+    if status != 200:
+        return False, f"HTTP {status}: {response_text}"
+    try:
+        data = _json_loads(response_text)
+    except Exception:
+        return False, f"无法解析的响应: {response_text}"
+    if isinstance(data, dict) and (data.get("status") == "ok" or data.get("retcode") == 0):
+        return True, _format_response(response_text)
+    return False, f"Napcat 返回失败: {_format_response(response_text)}"
+
+
+async def _upload_by_path(
+    sess: "aiohttp.ClientSession",
+    url: str,
+    json_payload: dict,
+    request_timeout: "aiohttp.ClientTimeout",
+) -> Tuple[bool, str]:
+    """JSON 方式上传：仅传递本地文件路径，要求 Napcat 与插件共享文件系统。"""
+    try:
+        async with sess.post(url, json=json_payload, timeout=request_timeout) as response:
+            return _check_napcat_response(response.status, await response.text())
+    except Exception as e:
+        return False, f"JSON 上传失败: {e}"
+
+
+async def _upload_by_form(
+    sess: "aiohttp.ClientSession",
+    url: str,
+    pdf_path: str,
+    filename: str,
+    scope: str,
+    target_id: int,
+    request_timeout: "aiohttp.ClientTimeout",
+) -> Tuple[bool, str]:
+    """FormData 方式上传：以流式方式上传文件二进制内容。"""
+    import aiofiles
+    import aiohttp
+
+    form = aiohttp.FormData()
+    if scope == "group":
+        form.add_field("group_id", str(target_id))
+    else:
+        form.add_field("user_id", str(target_id))
+
+    form.add_field("name", filename)
+    # 使用 aiofiles 异步分块读取，避免在事件循环线程上阻塞读盘
+    file_handle = await aiofiles.open(pdf_path, "rb")
+    payload = _sized_payload_class()(
+        _iter_file_chunks(file_handle),
+        size=os.path.getsize(pdf_path),
+        content_type="application/pdf",
+    )
+    form.add_field("file", payload, filename=filename)
+
+    try:
+        async with sess.post(url, data=form, timeout=request_timeout) as response:
+            return _check_napcat_response(response.status, await response.text())
+    finally:
+        await file_handle.close()
+
+
 async def upload_pdf_via_napcat(
     pdf_path: str,
     filename: str,
@@ -103,12 +781,17 @@ async def upload_pdf_via_napcat(
     target_id: int,
     napcat_base: str,
     timeout: int = 60,
+    upload_mode: str = "auto",
+    pool_size: int = 8,
 ) -> Tuple[bool, str]:
     """通过 Napcat API 上传 PDF 文件。
 
-    尝试两种方式上传：
-    1) JSON：传本地文件路径；失败则回退
-    2) FormData：上传二进制内容
+    支持两种上传方式：
+    1) path：JSON 传本地文件路径（需与 Napcat 共享文件系统）
+    2) form：FormData 以流式方式上传二进制内容
+
+    upload_mode 为 "auto" 时先尝试 path，失败（包括 HTTP 200 但响应 status 不为 ok）
+    再回退 form，并按 napcat_base 记住成功的方式，后续调用直接使用，省去一次必然失败的请求。
 
     Args:
         pdf_path: PDF 文件本地路径
@@ -117,6 +800,8 @@ async def upload_pdf_via_napcat(
         target_id: 群号或用户 ID
         napcat_base: Napcat API 基础 URL
         timeout: 请求总超时（秒）
+        upload_mode: 上传方式，"auto" / "path" / "form"
+        pool_size: 到 Napcat 的最大连接数，仅在首次创建会话时生效
 
     Returns:
         (是否成功, 响应文本或错误信息)
@@ -128,43 +813,31 @@ async def upload_pdf_via_napcat(
         url = f"{napcat_base}/upload_private_file"
         json_payload = {"user_id": target_id, "file": pdf_path, "name": filename}
 
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=timeout)) as sess:
-        # 方式 1：JSON 方式（直接传递文件路径）
-        try:
-            async with sess.post(url, json=json_payload) as response:
-                response_text = await response.text()
-                if response.status == 200:
-                    try:
-                        # 尝试格式化 JSON 响应
-                        return True, json.dumps(json.loads(response_text), ensure_ascii=False)
-                    except Exception:
-                        return True, response_text
-        except Exception:
-            pass  # 静默失败，继续尝试方式 2
-        
-        # 方式 2：FormData 方式（上传文件二进制）
-        form = aiohttp.FormData()
-        if scope == "group":
-            form.add_field("group_id", str(target_id))
-        else:
-            form.add_field("user_id", str(target_id))
+    import aiohttp
 
-        form.add_field("name", filename)
-        file_handle = open(pdf_path, "rb")
-        form.add_field("file", file_handle, filename=filename, content_type="application/pdf")
+    sess = await get_session(pool_size)
+    request_timeout = aiohttp.ClientTimeout(total=timeout)
 
-        try:
-            async with sess.post(url, data=form) as response:
-                response_text = await response.text()
-                if response.status == 200:
-                    try:
-                        return True, json.dumps(json.loads(response_text), ensure_ascii=False)
-                    except Exception:
-                        return True, response_text
-                else:
-                    return False, f"HTTP {response.status}: {response_text}"
-        finally:
-            file_handle.close()
+    if upload_mode == "path":
+        return await _upload_by_path(sess, url, json_payload, request_timeout)
+    if upload_mode == "form":
+        return await _upload_by_form(
+            sess, url, pdf_path, filename, scope, target_id, request_timeout
+        )
+
+    # auto：优先使用此前成功过的方式
+    if _UPLOAD_MODE_CACHE.get(napcat_base) != "form":
+        ok, msg = await _upload_by_path(sess, url, json_payload, request_timeout)
+        if ok:
+            _UPLOAD_MODE_CACHE[napcat_base] = "path"
+            return ok, msg
+
+    ok, msg = await _upload_by_form(
+        sess, url, pdf_path, filename, scope, target_id, request_timeout
+    )
+    if ok:
+        _UPLOAD_MODE_CACHE[napcat_base] = "form"
+    return ok, msg
 
 
 
@@ -172,166 +845,404 @@ async def upload_pdf_via_napcat(
 # JMComic 下载功能
 # =============================================================================
 
-async def check_album_chapters(
-    album_id: str,
-    output_dir: Optional[str] = None,
-) -> Tuple[bool, Optional[int], Optional[str]]:
-    """检查本子的章节数量。
+@dataclass
+class AlbumPlan:
+    """本子下载计划。
 
-    初始化 jmcomic 配置后查询指定 ID 的章节信息。
-    
-    Args:
-        album_id: 本子 ID
-        output_dir: 自定义输出目录，为空时使用默认目录
-    
-    Returns:
-        元组 (是否成功, 章节数量, 错误信息)
-        - 成功时返回 (True, 章节数, None)
-        - 失败时返回 (False, None, 错误信息)
+    由 get_album_plan 在一次元数据请求中生成，交给 async_download_album 执行，
+    避免为检查章节和下载分别获取本子详情。
     """
-    try:
-        import jmcomic
-    except Exception as e:
-        return False, None, f"jmcomic 导入失败: {e}"
 
-    try:
-        if output_dir is None:
+    album_id: str
+    option: Any
+    output_dir: str
+    total_chapters: int
+    photo_id: Optional[str] = None       # 要下载的章节 ID，为 None 时下载整本
+    chapter_index: Optional[int] = None  # 实际下载的章节号（从 1 开始），整本时为 None
+    notice: Optional[str] = None         # 需要提示给用户的章节选择说明
+
+
+def _resolve_output_dir(output_dir: Optional[str], plugin_dir: Optional[str]) -> str:
+    """确定下载目录，未指定时使用插件目录（或当前目录）下的 data。"""
+    if output_dir is None:
+        if plugin_dir:
+            output_dir = os.path.join(plugin_dir, "data")
+        else:
             output_dir = os.path.join(os.getcwd(), "data")
-        
-        output_dir = os.path.abspath(output_dir)
+    return os.path.abspath(output_dir)
+
+
+# 按（下载目录, 图片并发数）缓存 jmcomic 配置对象，配置不变时无需重复写入与解析 option.yml
+_OPTION_CACHE: Dict[Tuple[str, int], Any] = {}
+_OPTION_LOCK = threading.Lock()
+
+
+def _get_option(jmcomic, output_dir: str, image_threads: int = 30):
+    """获取下载目录对应的 jmcomic 配置对象。
+
+    首次使用某个目录时写入 option.yml 并据此创建配置，之后直接复用缓存；
+    下载目录或并发配置变更后会以新的键重新创建。
+
+    image_threads 写入 download.threading.image：jmcomic 下载单个章节时
+    按该数量并发请求图片（并负责图片的解密与重排）。
+
+    该函数在 jmcomic 线程池中调用，不在事件循环线程上做文件读写；
+    加锁保证并发的首次请求不会同时改写同一个 option.yml，
+    每个目录在进程内只写入一次。
+    """
+    cache_key = (output_dir, image_threads)
+    option = _OPTION_CACHE.get(cache_key)
+    if option is not None:
+        return option
+
+    with _OPTION_LOCK:
+        option = _OPTION_CACHE.get(cache_key)
+        if option is not None:
+            return option
+
         os.makedirs(output_dir, exist_ok=True)
-        
+
         option_file = os.path.join(output_dir, "option.yml")
         with open(option_file, "w", encoding="utf-8") as config_file:
-            config_file.write(f"dir_rule:\n  base_dir: {output_dir}\n")
-        
+            config_file.write(
+                f"dir_rule:\n  base_dir: {output_dir}\n"
+                f"download:\n  threading:\n    image: {max(1, image_threads)}\n"
+            )
+
         option = jmcomic.create_option_by_file(option_file)
-        
-        # 使用线程池避免阻塞异步事件循环
-        def get_album_info():
-            client = option.new_jm_client()
-            album = client.get_album_detail(album_id)
-            return len(album)
-        
-        chapter_count = await asyncio.to_thread(get_album_info)
-        return True, chapter_count, None
-    except Exception as e:
-        return False, None, f"获取章节信息失败: {e}"
+        _OPTION_CACHE[cache_key] = option
+        return option
 
 
-async def async_download_album(
+async def get_album_plan(
     album_id: str,
+    chapter_num: Optional[int] = None,
     output_dir: Optional[str] = None,
     plugin_dir: Optional[str] = None,
-    only_first_chapter: bool = False,
-    chapter_index: Optional[int] = None,
-) -> Tuple[bool, Optional[str], Optional[int]]:
-    """异步下载 JMComic 本子。
-    
-    支持三种下载模式：
-    1. 下载整本（only_first_chapter=False 且未指定 chapter_index）
-    2. 仅下载第一章（only_first_chapter=True）
-    3. 下载指定章节（指定 chapter_index，1-based）
-    
+    image_threads: int = 30,
+) -> Tuple[bool, Optional[AlbumPlan], Optional[str]]:
+    """获取本子章节信息并决定下载内容。
+
+    章节选择规则：
+    - 单章节本子：下载整本，忽略 chapter_num
+    - 多章节本子 + 未指定章节：下载第 1 章
+    - 多章节本子 + 有效章节：下载指定章节
+    - 多章节本子 + 超出范围的章节：下载第 1 章并提示
+
     Args:
         album_id: 本子 ID
+        chapter_num: 用户指定的章节号（从 1 开始），可为空
         output_dir: 自定义输出目录，为空时使用默认目录
         plugin_dir: 插件目录，用于确定默认的 data 目录位置
-        only_first_chapter: 是否仅下载第一章
-        chapter_index: 指定章节号（从 1 开始），优先级高于 only_first_chapter
-    
+        image_threads: 单个章节内并发下载的图片数
+
     Returns:
-        (是否成功, 图片目录或错误信息, 总章节数或 None)
+        元组 (是否成功, 下载计划, 错误信息)
+        - 成功时返回 (True, AlbumPlan, None)
+        - 失败时返回 (False, None, 错误信息)
     """
     try:
         import jmcomic
     except Exception as e:
-        return False, f"jmcomic 导入失败: {e}", None
+        return False, None, f"jmcomic 导入失败: {e}"
 
-    # 确定下载目录
-    if output_dir is None:
-        if plugin_dir:
-            output_dir = os.path.join(plugin_dir, "data")
+    output_dir = _resolve_output_dir(output_dir, plugin_dir)
+
+    # 配置创建与元数据请求都是阻塞操作，合并到一次线程池调用中完成
+    def prepare_album():
+        try:
+            option = _get_option(jmcomic, output_dir, image_threads)
+        except Exception as e:
+            return None, None, f"jmcomic 配置错误: {e}"
+        try:
+            client = option.new_jm_client()
+            album = client.get_album_detail(album_id)
+            return option, list(album), None
+        except Exception as e:
+            return None, None, f"获取章节信息失败: {e}"
+
+    option, chapters_list, error_msg = await run_in_jmcomic_pool(prepare_album)
+    if error_msg:
+        return False, None, error_msg
+
+    total_chapters = len(chapters_list)
+    if total_chapters == 0:
+        return False, None, "本子无章节信息"
+
+    plan = AlbumPlan(
+        album_id=album_id,
+        option=option,
+        output_dir=output_dir,
+        total_chapters=total_chapters,
+    )
+
+    if total_chapters > 1:
+        if chapter_num is None:
+            chapter_index = 1
+            plan.notice = f"检测到多章节本子({total_chapters}话)，仅下载第一章"
+        elif chapter_num > total_chapters:
+            chapter_index = 1
+            plan.notice = f"本子仅有{total_chapters}章，忽略无效的章节数，下载第一章"
         else:
-            output_dir = os.path.join(os.getcwd(), "data")
+            chapter_index = chapter_num
+            plan.notice = f"检测到多章节本子({total_chapters}话)，下载第{chapter_num}章"
 
-    output_dir = os.path.abspath(output_dir)
-    os.makedirs(output_dir, exist_ok=True)
+        photo_id = chapters_list[chapter_index - 1].photo_id
+        if photo_id is None:
+            return False, None, "无法获取指定章节信息"
+        plan.photo_id = photo_id
+        plan.chapter_index = chapter_index
+    elif chapter_num is not None:
+        plan.notice = "单章节本子，忽略章节数参数"
 
-    option_file = os.path.join(output_dir, "option.yml")
-    with open(option_file, "w", encoding="utf-8") as config_file:
-        config_file.write(f"dir_rule:\n  base_dir: {output_dir}\n")
+    return True, plan, None
 
-    try:
-        option = jmcomic.create_option_by_file(option_file)
-    except Exception as e:
-        return False, f"jmcomic 配置错误: {e}", None
-    
-    # 解析并确定要下载的章节
-    photo_id_to_download = None
-    total_chapters = None
-    download_chapter_index = None
-    
-    if chapter_index is not None or only_first_chapter:
-        try:
-            def get_album_chapters():
-                client = option.new_jm_client()
-                album = client.get_album_detail(album_id)
-                total = len(album)
-                return list(album), total
-            
-            chapters_list, total_chapters = await asyncio.to_thread(get_album_chapters)
-            
-            if total_chapters == 0:
-                return False, "本子无章节信息", None
-            
-            if chapter_index is not None:
-                # 用户指定了章节号（1-based），转换为内部索引（0-based）
-                idx = chapter_index - 1
-                if idx < 0 or idx >= total_chapters:
-                    download_chapter_index = 0 if only_first_chapter else None
-                else:
-                    download_chapter_index = idx
-            else:
-                download_chapter_index = 0
-            
-            if download_chapter_index is not None:
-                photo_id_to_download = chapters_list[download_chapter_index].photo_id
-                if photo_id_to_download is None:
-                    return False, "无法获取指定章节信息", None
-        except Exception as e:
-            return False, f"获取章节信息失败: {e}", None
 
-    try:
-        if download_chapter_index is not None:
-            await asyncio.to_thread(jmcomic.download_photo, photo_id_to_download, option)
-        else:
-            await asyncio.to_thread(jmcomic.download_album, album_id, option)
-    except Exception as e:
-        return False, f"下载失败: {e}", None
-    
+@functools.cache
+def _notifying_downloader_class():
+    """返回在每张图片保存后回调 on_image 的 JmDownloader 子类（首次调用时才导入 jmcomic）。"""
+    import jmcomic
+
+    class _NotifyingDownloader(jmcomic.JmDownloader):
+        def __init__(self, option, on_image: Optional[Callable[[str], None]] = None):
+            super().__init__(option)
+            self.on_image = on_image
+
+        def after_image(self, image, img_save_path):
+            super().after_image(image, img_save_path)
+            if self.on_image is not None:
+                try:
+                    self.on_image(img_save_path)
+                except Exception:
+                    pass
+
+    return _NotifyingDownloader
+
+
+def _run_download(
+    jmcomic,
+    plan: AlbumPlan,
+    on_image: Optional[Callable[[str], None]] = None,
+) -> Tuple[Optional[str], List[str]]:
+    """同步执行下载并定位图片目录，供线程池一次性调用。
+
+    Args:
+        on_image: 每张图片保存后以其路径调用（在 jmcomic 下载线程中执行），可选
+
+    Returns:
+        (包含图片的下载目录, 排序后的图片路径列表)，未找到时返回 (None, [])
+    """
+    downloader = None
+    if on_image is not None:
+        downloader = functools.partial(_notifying_downloader_class(), on_image=on_image)
+
+    if plan.photo_id is not None:
+        jmcomic.download_photo(plan.photo_id, plan.option, downloader)
+    else:
+        jmcomic.download_album(plan.album_id, plan.option, downloader)
+
     # 定位下载的图片目录
     # jmcomic 会在输出目录下创建子目录，需要找到包含图片的目录
-    subdirs = [d for d in Path(output_dir).iterdir() if d.is_dir()]
-    if not subdirs:
-        return False, "未找到下载目录", None
-    
+    subdirs = [d for d in Path(plan.output_dir).iterdir() if d.is_dir()]
     subdirs.sort(key=lambda d: d.stat().st_mtime, reverse=True)
-    
-    target_dir = None
-    image_extensions = [".jpg", ".jpeg", ".png", ".webp"]
+
     for subdir in subdirs:
-        images = []
-        for ext in image_extensions:
-            images.extend(subdir.rglob(f"*{ext}"))
+        images = _collect_images(str(subdir))
         if images:
-            target_dir = str(subdir)
-            break
+            return str(subdir), images
+    return None, []
+
+
+async def async_download_album(
+    plan: AlbumPlan,
+    on_image: Optional[Callable[[str], None]] = None,
+) -> Tuple[bool, Optional[str], Optional[int], List[str]]:
+    """按下载计划异步下载 JMComic 本子。
+
+    计划中指定了章节时仅下载该章节，否则下载整本。
+    下载与目录定位在同一次线程池调用中完成，事件循环只让出一次。
+
+    Args:
+        plan: get_album_plan 生成的下载计划
+        on_image: 每张图片保存后的回调，见 _run_download
+
+    Returns:
+        (是否成功, 图片目录或错误信息, 总章节数或 None, 排序后的图片路径列表)
+    """
+    try:
+        import jmcomic
+    except Exception as e:
+        return False, f"jmcomic 导入失败: {e}", None, []
+
+    try:
+        target_dir, img_paths = await run_in_jmcomic_pool(_run_download, jmcomic, plan, on_image)
+    except Exception as e:
+        return False, f"下载失败: {e}", None, []
 
     if not target_dir:
-        return False, "未找到图片目录", None
+        return False, "未找到图片目录", None, []
 
-    return True, target_dir, total_chapters
+    return True, target_dir, plan.total_chapters, img_paths
+
+
+
+# =============================================================================
+# PDF 缓存
+# =============================================================================
+
+# 正在生成或上传中的缓存文件（路径 -> 引用计数）。淘汰时跳过这些文件，
+# 避免删除其他命令正在写入的 .part 或 path 模式下 Napcat 正在读取的 PDF。
+# 淘汰在线程中执行，登记与删除都在同一把锁下进行。
+_CACHE_IN_USE: Dict[str, int] = {}
+_CACHE_LOCK = threading.Lock()
+
+
+def _cache_file_name(prefix: str, pages: int, image_bytes: int) -> str:
+    """缓存文件名：前缀（本子/章节与 PDF 参数）后附页数与图片总字节数。
+
+    命中缓存时据此重新检查 max_pdf_pages / max_pdf_bytes，无需打开 PDF。
+    """
+    return f"{prefix}.p{pages}.b{image_bytes}.pdf"
+
+
+def _release_cached_pdf(path: str) -> None:
+    """撤销一次 _acquire_cached_pdf / _new_part_path / _store_cached_pdf 的登记。"""
+    with _CACHE_LOCK:
+        count = _CACHE_IN_USE.get(path, 0) - 1
+        if count > 0:
+            _CACHE_IN_USE[path] = count
+        else:
+            _CACHE_IN_USE.pop(path, None)
+
+
+def _pin_locked(path: str) -> None:
+    """登记正在使用的缓存文件，调用方须持有 _CACHE_LOCK。"""
+    _CACHE_IN_USE[path] = _CACHE_IN_USE.get(path, 0) + 1
+
+
+def _acquire_cached_pdf(cache_dir: str, prefix: str) -> Optional[Tuple[str, int, int]]:
+    """查找前缀对应的缓存 PDF，找到时登记为使用中并更新其修改时间。
+
+    修改时间作为最近使用时间，不依赖 atime：很多文件系统以 noatime/relatime 挂载，
+    访问时间并不可靠。用完后须调用 _release_cached_pdf。
+
+    Returns:
+        (缓存文件路径, 页数, 图片总字节数)，未命中时返回 None
+    """
+    pattern = re.compile(re.escape(prefix) + r"\.p(\d+)\.b(\d+)\.pdf")
+    try:
+        with os.scandir(cache_dir) as it:
+            names = [entry.name for entry in it]
+    except OSError:
+        return None
+
+    for name in names:
+        match = pattern.fullmatch(name)
+        if match is None:
+            continue
+        path = os.path.join(cache_dir, name)
+        with _CACHE_LOCK:
+            try:
+                os.utime(path)
+            except OSError:
+                continue
+            _pin_locked(path)
+        return path, int(match.group(1)), int(match.group(2))
+    return None
+
+
+def _new_part_path(cache_dir: str, prefix: str) -> str:
+    """为一次合成创建唯一的 .part 临时文件并登记为使用中，同一本子并发合成时互不干扰。"""
+    os.makedirs(cache_dir, exist_ok=True)
+    with _CACHE_LOCK:
+        fd, path = tempfile.mkstemp(dir=cache_dir, prefix=f"{prefix}.", suffix=".part")
+        os.close(fd)
+        _pin_locked(path)
+    return path
+
+
+def evict_pdf_cache(cache_dir: str, max_bytes: int) -> None:
+    """按最近使用时间淘汰缓存 PDF，直到总大小不超过 max_bytes。
+
+    使用中的文件不参与淘汰；未登记的 .part 文件是异常退出残留的，直接删除。
+
+    Args:
+        cache_dir: 缓存目录
+        max_bytes: 缓存总大小上限（字节）
+    """
+    try:
+        with os.scandir(cache_dir) as it:
+            entries = [
+                (entry.stat().st_mtime, entry.stat().st_size, entry.path)
+                for entry in it
+                if entry.is_file() and entry.name.endswith((".pdf", ".part"))
+            ]
+    except OSError:
+        return
+
+    with _CACHE_LOCK:
+        live = []
+        for entry in entries:
+            path = entry[2]
+            if path.endswith(".part") and path not in _CACHE_IN_USE:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            else:
+                live.append(entry)
+    entries = live
+
+    total = sum(size for _, size, _ in entries)
+    entries.sort()  # 最久未使用的在前
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        with _CACHE_LOCK:
+            if path in _CACHE_IN_USE:
+                continue
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+
+def _store_cached_pdf(
+    part_path: str,
+    cache_dir: str,
+    prefix: str,
+    image_paths: List[str],
+    max_bytes: int,
+) -> Optional[str]:
+    """将生成完成的 .part 文件原子替换为缓存文件，随后执行淘汰。
+
+    单个文件就超过缓存上限时不放入缓存，保留 .part 文件供本次上传后删除；
+    放入成功时缓存文件登记为使用中（用完后须调用 _release_cached_pdf），
+    保证随后的上传能读到它。
+
+    Args:
+        part_path: 已生成的 .part 文件
+        cache_dir: 缓存目录
+        prefix: 缓存文件名前缀，见 _cache_file_name
+        image_paths: 合成该 PDF 的图片，页数与总字节数写入文件名
+        max_bytes: 缓存总大小上限（字节）
+
+    Returns:
+        缓存文件路径，未放入缓存时返回 None
+
+    Raises:
+        OSError: 读取或替换文件失败时
+    """
+    if os.path.getsize(part_path) > max_bytes:
+        return None
+    image_bytes = sum(os.stat(p).st_size for p in image_paths)
+    cached_path = os.path.join(cache_dir, _cache_file_name(prefix, len(image_paths), image_bytes))
+    with _CACHE_LOCK:
+        os.replace(part_path, cached_path)
+        _pin_locked(cached_path)
+    evict_pdf_cache(cache_dir, max_bytes)
+    return cached_path
 
 
 
@@ -339,6 +1250,56 @@ async def async_download_album(
 # 命令处理
 # =============================================================================
 
+@dataclass(frozen=True)
+class JMConfig:
+    """jm 段配置的只读快照。
+
+    字段名与 config.toml 中 jm 段的键一一对应，默认值只在 JMPlugin.config_schema 中定义；
+    通过 load 一次性读取全部键，之后以属性访问代替逐键调用 get_config。
+    """
+
+    jm_data_dir: str
+    napcat_base_url: str
+    max_pdf_pages: int
+    max_pdf_bytes: int
+    napcat_upload_mode: str
+    napcat_pool_size: int
+    pdf_max_dim: int
+    pdf_jpeg_quality: int
+    pdf_cache_max_bytes: int
+    jm_download_workers: int
+    image_concurrency: int
+    pdf_workers: int
+    pdf_process_workers: int
+
+    @classmethod
+    def load(cls, get_config: Callable[[str, Any], Any]) -> "JMConfig":
+        """通过组件的 get_config 读取 jm 段配置，缺失的键使用 config_schema 中的默认值。"""
+        schema = JMPlugin.config_schema["jm"]
+        return cls(**{f.name: get_config(f"jm.{f.name}", schema[f.name].default) for f in fields(cls)})
+
+
+# 最近一次读取的（插件配置对象, JMConfig 快照）。宿主为每条消息新建命令实例，
+# 传入的是插件持有的配置字典：同一对象直接复用快照，内容相同的副本也复用，
+# 内容变化后才重新读取；插件重新加载时在 JMPlugin.__init__ 中刷新
+_CONFIG_SNAPSHOT: Optional[Tuple[Any, JMConfig]] = None
+
+
+def _config_snapshot(
+    config_obj: Any,
+    get_config: Callable[[str, Any], Any],
+    refresh: bool = False,
+) -> JMConfig:
+    """返回 config_obj 对应的 JMConfig 快照，仅在首次或配置对象更换时调用 get_config。"""
+    global _CONFIG_SNAPSHOT
+    cached = _CONFIG_SNAPSHOT
+    if not refresh and cached is not None and (cached[0] is config_obj or cached[0] == config_obj):
+        return cached[1]
+    snapshot = JMConfig.load(get_config)
+    _CONFIG_SNAPSHOT = (config_obj, snapshot)
+    return snapshot
+
+
 class JMCommand(BaseCommand):
     """JM 本子下载命令处理器。
 
@@ -353,10 +1314,15 @@ class JMCommand(BaseCommand):
     command_description = "下载 JM 本子为 PDF 并上传。用法：/jm ID 或 /jm ID 章节数"
     command_pattern = r"^/jm(?:\s+(?P<args>.+))?$"
 
+    @property
+    def cfg(self) -> JMConfig:
+        """jm 段配置快照，同一份插件配置只读取一次，跨命令复用。"""
+        return _config_snapshot(self.plugin_config, self.get_config)
+
     async def execute(self) -> Tuple[bool, Optional[str], bool]:
         """执行命令主逻辑。
         
-        下载策略：
+        下载策略（由 get_album_plan 决定）：
         - 单章节漫画：下载全部，忽略章节参数
         - 多章节漫画 + 无章节参数：下载第一章
         - 多章节漫画 + 有效章节参数：下载指定章节
@@ -388,124 +1354,215 @@ class JMCommand(BaseCommand):
                 await self.send_text("章节数必须为正整数")
                 return True, None, True
 
-        await self.send_text("开始下载")
+        # 状态消息与后续工作并发发送，在下一条消息前等待以保证顺序
+        msg_task = asyncio.create_task(self.send_text("开始下载"))
 
         plugin_dir = os.path.dirname(os.path.abspath(__file__))
-        jm_data_dir = self.get_config("jm.jm_data_dir","")
-        napcat_base_url = self.get_config("jm.napcat_base_url")
-        max_pdf_pages = self.get_config("jm.max_pdf_pages")
+        cfg = self.cfg
 
-        success, chapter_count, error_msg = await check_album_chapters(
-            album_id,
-            output_dir=jm_data_dir or None,
+        init_executors(
+            jm_download_workers=cfg.jm_download_workers,
+            pdf_workers=cfg.pdf_workers,
+            pdf_process_workers=cfg.pdf_process_workers,
+        )
+
+        pdf_dir = os.path.join(plugin_dir, "tmp_pdf")
+        use_cache = cfg.pdf_cache_max_bytes > 0
+
+        # 元数据请求与临时 PDF 目录准备互不依赖：先启动计划任务，目录在线程中创建；
+        # 启用缓存时 PDF 直接写入缓存目录，无需临时目录
+        plan_task = asyncio.create_task(
+            get_album_plan(
+                album_id,
+                chapter_num=chapter_num,
+                output_dir=cfg.jm_data_dir or None,
+                plugin_dir=plugin_dir,
+                image_threads=cfg.image_concurrency,
+            )
         )
+        try:
+            if not use_cache:
+                await asyncio.to_thread(os.makedirs, pdf_dir, exist_ok=True)
+            success, plan, error_msg = await plan_task
+            await msg_task
+        finally:
+            # 出错时不留下无人等待的任务
+            for task in (plan_task, msg_task):
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(plan_task, msg_task, return_exceptions=True)
 
         if not success:
             await self.send_text(f"检查章节信息失败: {error_msg}")
             return True, error_msg, True
 
-    # 决定下载策略
-        only_first_chapter = False
-        use_chapter_index = None
-        
-        if chapter_count > 1:
-            if chapter_num is not None:
-                if chapter_num > chapter_count:
-                    only_first_chapter = True
-                    await self.send_text(f"本子仅有{chapter_count}章，忽略无效的章节数，下载第一章")
-                else:
-                    use_chapter_index = chapter_num
-                    await self.send_text(f"检测到多章节本子({chapter_count}话)，下载第{chapter_num}章")
+        msg_task = None
+        if plan.notice:
+            msg_task = asyncio.create_task(self.send_text(plan.notice))
+
+        safe_name = sanitize_filename(album_id)
+        if plan.chapter_index is not None:
+            safe_name = f"{safe_name}_{plan.chapter_index:02d}"
+
+        # 缓存文件名带上影响输出的 PDF 参数，参数变化后不会命中旧文件
+        cache_dir = os.path.join(plan.output_dir, "cache")
+        cache_prefix = f"{safe_name}.d{cfg.pdf_max_dim}q{cfg.pdf_jpeg_quality}"
+
+        # 登记为使用中的缓存文件（命中的缓存、.part 与新放入的缓存），命令结束时统一撤销
+        pinned: List[str] = []
+        try:
+            hit = None
+            if use_cache:
+                hit = await asyncio.to_thread(_acquire_cached_pdf, cache_dir, cache_prefix)
+            if hit is not None:
+                pdf_path, cached_pages, cached_bytes = hit
+                pinned.append(pdf_path)
+                if msg_task is not None:
+                    await msg_task
+                # 缓存可能生成于限制调低之前，按当前配置重新检查
+                try:
+                    check_limit_totals(
+                        cached_pages, cached_bytes, cfg.max_pdf_pages, cfg.max_pdf_bytes
+                    )
+                except PdfLimitError as e:
+                    await self.send_text(str(e))
+                    return True, str(e), True
+                await self.send_text("命中缓存，直接上传")
+                remove_after_upload = False
             else:
-                only_first_chapter = True
-                await self.send_text(f"检测到多章节本子({chapter_count}话)，仅下载第一章")
-        else:
-            if chapter_num is not None:
-                await self.send_text("单章节本子，忽略章节数参数")
-
-        success, album_dir, total_chapters = await async_download_album(
-            album_id,
-            output_dir=jm_data_dir or None,
-            plugin_dir=plugin_dir,
-            only_first_chapter=only_first_chapter,
-            chapter_index=use_chapter_index,
-        )
+                # 图片边下载边转码，下载结束时大部分页面已准备好
+                prefetcher = PagePrefetcher(
+                    cfg.pdf_max_dim, cfg.pdf_jpeg_quality, cfg.max_pdf_pages, cfg.max_pdf_bytes
+                )
+                success, album_dir, total_chapters, img_paths = await async_download_album(
+                    plan, on_image=prefetcher.submit
+                )
+                if msg_task is not None:
+                    await msg_task
+
+                if not success:
+                    prefetcher.cancel()
+                    await self.send_text("下载失败")
+                    return True, album_dir, True
+
+                album_name = os.path.basename(album_dir)
+                await self.send_text(album_name)
+
+                if not img_paths:
+                    prefetcher.cancel()
+                    await self.send_text("未找到图片")
+                    return True, None, True
 
-        if not success:
-            await self.send_text("下载失败")
-            return True, album_dir, True
+                # 生成 PDF（启用缓存时先写入 .part 文件，完成后原子替换）
+                if use_cache:
+                    build_path = await asyncio.to_thread(_new_part_path, cache_dir, cache_prefix)
+                    pinned.append(build_path)
+                else:
+                    pdf_path = os.path.join(pdf_dir, f"{safe_name}.pdf")
+                    build_path = pdf_path
+                remove_after_upload = not use_cache
+
+                try:
+                    await images_to_pdf(
+                        img_paths,
+                        build_path,
+                        max_dim=cfg.pdf_max_dim,
+                        jpeg_quality=cfg.pdf_jpeg_quality,
+                        max_pages=cfg.max_pdf_pages,
+                        max_total_bytes=cfg.max_pdf_bytes,
+                        prepared=await prefetcher.collect(),
+                    )
+                except PdfLimitError as e:
+                    _spawn_background(_remove_quietly(build_path))
+                    await self.send_text(str(e))
+                    return True, str(e), True
+                except Exception as e:
+                    _spawn_background(_remove_quietly(build_path))
+                    await self.send_text("PDF 生成失败")
+                    return True, str(e), True
+
+                if use_cache:
+                    try:
+                        pdf_path = await asyncio.to_thread(
+                            _store_cached_pdf, build_path, cache_dir, cache_prefix,
+                            img_paths, cfg.pdf_cache_max_bytes,
+                        )
+                    except OSError:
+                        pdf_path = None
+                    if pdf_path is None:
+                        # 未能放入缓存（如超过缓存上限）时直接从 .part 上传，完成后删除
+                        pdf_path = build_path
+                        remove_after_upload = True
+                    else:
+                        pinned.append(pdf_path)
+
+            # 确定上传目标
+            is_group = False
+            group_id = None
+            user_id = None
+        
+            try:
+                message_info = self.message.message_info
+                if message_info.group_info and message_info.group_info.group_id:
+                    is_group = True
+                    group_id = int(message_info.group_info.group_id)
+                elif message_info.user_info and message_info.user_info.user_id:
+                    user_id = int(message_info.user_info.user_id)
+            except Exception:
+                pass
+
+            if is_group:
+                ok, msg = await upload_pdf_via_napcat(
+                    pdf_path, f"{safe_name}.pdf", "group", group_id, cfg.napcat_base_url,
+                    upload_mode=cfg.napcat_upload_mode,
+                    pool_size=cfg.napcat_pool_size,
+                )
+            elif user_id:
+                ok, msg = await upload_pdf_via_napcat(
+                    pdf_path, f"{safe_name}.pdf", "private", user_id, cfg.napcat_base_url,
+                    upload_mode=cfg.napcat_upload_mode,
+                    pool_size=cfg.napcat_pool_size,
+                )
+            else:
+                if remove_after_upload:
+                    _spawn_background(_remove_quietly(pdf_path))
+                await self.send_text("无法识别发送对象")
+                return True, None, True
 
-        album_name = os.path.basename(album_dir)
-        await self.send_text(album_name)
+            # 临时 PDF 的清理放到后台进行，不阻塞命令返回；缓存文件保留
+            if remove_after_upload:
+                _spawn_background(_remove_quietly(pdf_path))
 
-    # 收集图片文件
-        supported_extensions = {".jpg", ".jpeg", ".png", ".webp"}
-        img_paths = sorted(
-            [p for p in Path(album_dir).rglob("*") if p.suffix.lower() in supported_extensions],
-            key=lambda p: p.as_posix()
-        )
+            if not ok:
+                await self.send_text("上传失败")
+                return True, msg, True
 
-        if not img_paths:
-            await self.send_text("未找到图片")
-            return True, None, True
+            return True, "完成", True
+        finally:
+            for path in pinned:
+                _release_cached_pdf(path)
 
-        if len(img_paths) > max_pdf_pages:
-            await self.send_text(f"页数超过 {max_pdf_pages}，不生成 PDF")
-            return True, None, True
 
-    # 生成 PDF
-        safe_name = sanitize_filename(album_id)
-        if use_chapter_index is not None:
-            safe_name = f"{safe_name}_{use_chapter_index:02d}"
-        elif only_first_chapter:
-            safe_name = f"{safe_name}_01"
-        pdf_dir = os.path.join(plugin_dir, "tmp_pdf")
-        os.makedirs(pdf_dir, exist_ok=True)
-        pdf_path = os.path.join(pdf_dir, f"{safe_name}.pdf")
 
-        try:
-            await asyncio.to_thread(images_to_pdf_sync, img_paths, pdf_path)
-        except Exception as e:
-            await self.send_text("PDF 生成失败")
-            return True, str(e), True
+# =============================================================================
+# 事件处理
+# =============================================================================
 
-    # 确定上传目标
-        is_group = False
-        group_id = None
-        user_id = None
-        
-        try:
-            message_info = self.message.message_info
-            if message_info.group_info and message_info.group_info.group_id:
-                is_group = True
-                group_id = int(message_info.group_info.group_id)
-            elif message_info.user_info and message_info.user_info.user_id:
-                user_id = int(message_info.user_info.user_id)
-        except Exception:
-            pass
+if BaseEventHandler is not None and hasattr(EventType, "ON_STOP"):
 
-        if is_group:
-            ok, msg = await upload_pdf_via_napcat(
-                pdf_path, f"{safe_name}.pdf", "group", group_id, napcat_base_url
-            )
-        elif user_id:
-            ok, msg = await upload_pdf_via_napcat(
-                pdf_path, f"{safe_name}.pdf", "private", user_id, napcat_base_url
-            )
-        else:
-            await self.send_text("无法识别发送对象")
-            return True, None, True
+    class JMStopHandler(BaseEventHandler):
+        """宿主停止时关闭全局 Napcat 会话，释放连接池。"""
 
-        if not ok:
-            await self.send_text("上传失败")
-            return True, msg, True
+        event_type = EventType.ON_STOP
+        handler_name = "jm_close_session"
+        handler_description = "关闭 JM 插件的 Napcat HTTP 会话"
 
-        try:
-            os.remove(pdf_path)
-        except Exception:
-            pass
+        async def execute(self, message):
+            await close_session()
+            return True, True, None, None, None
 
-        return True, "完成", True
+else:
+    JMStopHandler = None
 
 
 
@@ -518,7 +1575,7 @@ class JMPlugin(BasePlugin):
     """JM 漫画下载插件主类。
     
     本插件为 MaiBot 提供 JMComic 图集下载功能。
-    通过集成 jmcomic 库实现图集爬取，使用 Pillow 进行 PDF 转换，
+    通过集成 jmcomic 库实现图集爬取，使用 img2pdf / Pillow 进行 PDF 转换，
     最后通过 Napcat API 将文件上传到 QQ。
     
     主要特性：
@@ -530,14 +1587,16 @@ class JMPlugin(BasePlugin):
     Python 依赖：
     - jmcomic: JMComic 爬虫库
     - pillow: 图片处理和 PDF 生成
+    - img2pdf: JPEG 无损嵌入 PDF
     - aiohttp: HTTP 客户端
+    - aiofiles: 异步文件读取（流式上传）
     """
     
     plugin_name: str = "jm_plugin"
     enable_plugin: bool = True
 
     dependencies: List[str] = []
-    python_dependencies: List[str] = ["jmcomic", "pillow", "aiohttp"]
+    python_dependencies: List[str] = ["jmcomic", "pillow", "img2pdf", "aiohttp", "aiofiles"]
 
     config_file_name: str = "config.toml"
     
@@ -553,14 +1612,81 @@ class JMPlugin(BasePlugin):
                 default="http://127.0.0.1:3000",
                 description="Napcat 机器人框架的 API 基础 URL"
             ),
+            "napcat_upload_mode": ConfigField(
+                type=str,
+                default="auto",
+                description="Napcat 上传方式：auto 自动探测 / path 传本地路径（共享文件系统）/ form 上传文件内容"
+            ),
+            "napcat_pool_size": ConfigField(
+                type=int,
+                default=8,
+                description="到 Napcat 的最大并发连接数（重启后生效）"
+            ),
             "max_pdf_pages": ConfigField(
                 type=int,
                 default=300,
-                description="PDF 最大页数限制"
+                description="PDF 最大页数限制，0 表示不限制"
+            ),
+            "max_pdf_bytes": ConfigField(
+                type=int,
+                default=1073741824,
+                description="合成 PDF 的图片总字节数上限，超出则不生成 PDF，0 表示不限制"
+            ),
+            "pdf_max_dim": ConfigField(
+                type=int,
+                default=2048,
+                description="PDF 页面长边像素上限，超出时等比缩小，0 表示不缩放"
+            ),
+            "pdf_jpeg_quality": ConfigField(
+                type=int,
+                default=75,
+                description="PDF 页面 JPEG 编码质量（1-95）"
+            ),
+            "pdf_cache_max_bytes": ConfigField(
+                type=int,
+                default=2147483648,
+                description="已生成 PDF 的磁盘缓存上限（字节），超出时淘汰最久未使用的文件，0 表示关闭缓存"
+            ),
+            "jm_download_workers": ConfigField(
+                type=int,
+                default=4,
+                description="jmcomic 下载专用线程池大小（重启后生效）"
+            ),
+            "image_concurrency": ConfigField(
+                type=int,
+                default=30,
+                description="单个章节内并发下载的图片数"
+            ),
+            "pdf_workers": ConfigField(
+                type=int,
+                default=0,
+                description="PDF 页面处理线程池大小，即同时解码/编码的页面数上限，0 表示使用 CPU 核心数（重启后生效）"
+            ),
+            "pdf_process_workers": ConfigField(
+                type=int,
+                default=0,
+                description="PDF 页面处理进程池大小，大于 0 时在独立进程中解码/编码页面，0 表示不启用（重启后生效）"
             ),
         }
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 建立配置快照供命令复用，并按配置上限清理一次 PDF 缓存
+        try:
+            cfg = _config_snapshot(self.config, self.get_config, refresh=True)
+            if cfg.pdf_cache_max_bytes > 0:
+                plugin_dir = os.path.dirname(os.path.abspath(__file__))
+                data_dir = _resolve_output_dir(cfg.jm_data_dir or None, plugin_dir)
+                evict_pdf_cache(os.path.join(data_dir, "cache"), cfg.pdf_cache_max_bytes)
+        except Exception:
+            pass
+
     def get_plugin_components(self) -> List[Tuple[ComponentInfo, Type]]:
-        """返回插件提供的命令组件列表。"""
-        return [(JMCommand.get_command_info(), JMCommand)]
+        """返回插件提供的组件列表（宿主不支持事件处理器时只有命令）。"""
+        components: List[Tuple[ComponentInfo, Type]] = [
+            (JMCommand.get_command_info(), JMCommand),
+        ]
+        if JMStopHandler is not None:
+            components.append((JMStopHandler.get_handler_info(), JMStopHandler))
+        return components